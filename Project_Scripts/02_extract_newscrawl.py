@@ -3,6 +3,8 @@ import os
 import logging
 from warcio.archiveiterator import ArchiveIterator
 import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
 from os import listdir
 from multiprocessing import Pool
 from tqdm import tqdm
@@ -15,13 +17,25 @@ logging.basicConfig(
     handlers=[logging.StreamHandler()]
 )
 
+# Content keeps the raw HTTP payload bytes; Trafilatura detects the encoding itself
+WARC_SCHEMA = pa.schema([
+    ("ID", pa.string()),
+    ("URL", pa.string()),
+    ("Date", pa.string()),
+    ("Content-Length", pa.string()),
+    ("MIME-Type", pa.string()),
+    ("Content", pa.binary()),
+])
+
 def extract_records(warc_file_path):
     """Extract records from a WARC file."""
     records = []
     try:
         with gzip.open(warc_file_path, 'rb') as stream:
             iterator = ArchiveIterator(stream)
-            for record in tqdm(iterator, desc=f"Extracting {os.path.basename(warc_file_path)}", leave=False):
+            # Throttled: this inner bar runs in every worker process, once per WARC record
+            for record in tqdm(iterator, desc=f"Extracting {os.path.basename(warc_file_path)}", leave=False,
+                               mininterval=2.0, miniters=1000):
                 if record.rec_type == 'response':
                     try:
                         warc_record_id = record.rec_headers.get_header('WARC-Record-ID')
@@ -48,11 +62,11 @@ def process_warc_file(warc_file_path):
         
         if data:
             # Convert to DataFrame
-            df = pd.DataFrame(data, columns=["ID", "URL", "Date", "Content-Length", "MIME-Type", "Content"])
+            df = pd.DataFrame(data, columns=WARC_SCHEMA.names)
             
-            # Save DataFrame as Feather file
+            # Save as Feather file with an explicit schema so Content stays binary
             output_path = warc_file_path.replace(".warc.gz", ".feather")
-            df.to_feather(output_path)
+            feather.write_feather(pa.Table.from_pandas(df, schema=WARC_SCHEMA, preserve_index=False), output_path)
             logging.info(f"Saved Feather file: {output_path}")
             
             # Delete WARC file after successful processing
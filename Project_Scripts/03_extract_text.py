@@ -6,14 +6,18 @@ Updated for improved maintainability and robustness.
 """
 from tqdm import tqdm
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 import multiprocessing
 import os
 import logging
 import trafilatura
-import json
-from urllib.parse import urlparse
+from trafilatura.settings import use_config
+import xxhash
+import re
 from argparse import ArgumentParser
 from functools import partial
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Configure logging
 logging.basicConfig(
@@ -22,82 +26,218 @@ logging.basicConfig(
     handlers=[logging.StreamHandler()]
 )
 
-def extract_top_level_domain(url):
-    """Extract the top-level domain (TLD) from a URL."""
+# Columns of the processed feather files, written incrementally in batches
+OUTPUT_COLUMNS = ("id", "text", "url", "excerpt", "date", "tags", "categories", "title", "date_crawled", "hostname")
+OUTPUT_SCHEMA = pa.schema([(name, pa.string()) for name in OUTPUT_COLUMNS])
+WRITE_BATCH_SIZE = 5000
+
+# Records with less HTML than this cannot yield an article and are not sent to Trafilatura
+MIN_CONTENT_BYTES = 512
+
+# Per-file progress is logged every LOG_EVERY records
+LOG_EVERY = 5000
+
+# Host part of a URL (scheme required; userinfo and port are skipped)
+HOST_PATTERN = re.compile(r"^[a-z][a-z0-9+.\-]*://(?:[^/?#@]*@)?([^/:?#]*)", re.IGNORECASE)
+
+def extract_top_level_domains(urls):
+    """
+    Extract the lowercase, dot-prefixed TLD from each URL in a Series.
+
+    The host is matched with HOST_PATTERN; hosts without a dot are returned as is.
+    """
+    hosts = urls.str.extract(HOST_PATTERN, expand=False).str.lower()
+    parts = hosts.str.rsplit(".", n=1)
+    return parts.str[-1].where(parts.str.len() < 2, "." + parts.str[-1])
+
+# Trafilatura config and options are bound once instead of being rebuilt on every call
+TRAFILATURA_CONFIG = use_config()
+extract_article = partial(
+    trafilatura.bare_extraction,
+    # "json" keeps raw_text space-joined on one line like the old JSON output
+    # (the default "python" format puts one paragraph per line); nothing is serialized
+    output_format="json",
+    include_comments=False,
+    deduplicate=True,
+    with_metadata=True,
+    config=TRAFILATURA_CONFIG,
+    # target_language removed - accepting all languages
+)
+
+def join_metadata_list(values):
+    """Join list metadata the way Trafilatura's JSON output does (semicolon-separated)."""
+    if isinstance(values, (list, tuple)):
+        return ";".join(values)
+    return values
+
+def extract_record(record, fast=False):
+    """
+    Run Trafilatura on a single (content, url, id) record inside a worker process.
+
+    Returns an output row in OUTPUT_COLUMNS order, or None if no article text was found.
+    Only plain strings are returned: the extraction dict also holds lxml elements
+    (body, commentsbody), which cannot be pickled back to the parent process.
+    """
+    content, url, record_id = record
     try:
-        parsed_url = urlparse(url)
-        domain_parts = parsed_url.netloc.split('.')
-        if len(domain_parts) > 1:
-            return '.' + domain_parts[-1]
-        return domain_parts[0]
+        extracted = extract_article(content, fast=fast)
+        if extracted is not None and not isinstance(extracted, dict):
+            # Newer Trafilatura versions return a Document object
+            extracted = extracted.as_dict()
+        if not extracted or extracted.get("raw_text") is None:
+            return None
+
+        # Same order as OUTPUT_COLUMNS
+        return (
+            record_id,
+            extracted.get("raw_text"),
+            url,
+            extracted.get("description"),
+            extracted.get("date"),
+            join_metadata_list(extracted.get("tags")),
+            join_metadata_list(extracted.get("categories")),
+            extracted.get("title"),
+            extracted.get("filedate"),
+            extracted.get("hostname")
+        )
     except Exception as e:
-        logging.warning(f"Error extracting TLD from {url}: {e}")
+        logging.warning(f"Error processing record {url}: {e}")
         return None
 
-def parse_file(filename, exclude_tlds):
-    """Parse a single feather file and extract text using Trafilatura."""
+def prefetch_file(filename):
+    """Ask the kernel to read the file into the page cache in the background (where supported)."""
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        fd = os.open(filename, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+    except OSError as e:
+        logging.debug(f"Could not prefetch {filename}: {e}")
+
+def iter_records(filename, exclude_tlds):
+    """
+    Yield (content, url, id) records from a feather file one record batch at a time.
+
+    Content is yielded as the raw bytes stored by step 02 and handed to Trafilatura
+    undecoded, so no extra decode/copy happens in this process.
+    """
+    skipped = 0
+    prefetch_file(filename)
+    with pa.memory_map(filename) as source:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+
+            # Build one mask: skip empty or tiny payloads and excluded TLDs
+            content_size = pc.fill_null(pc.binary_length(batch.column("Content")), 0)
+            keep = content_size.to_numpy(zero_copy_only=False) >= MIN_CONTENT_BYTES
+            skipped += int((~keep).sum())
+            if exclude_tlds:
+                tlds = extract_top_level_domains(batch.column("URL").to_pandas())
+                keep &= ~tlds.isin(exclude_tlds).to_numpy()
+
+            batch = batch.filter(pa.array(keep))
+            yield from zip(batch.column("Content").to_pylist(), batch.column("URL").to_pylist(), batch.column("ID").to_pylist())
+            del batch
+
+    if skipped:
+        logging.info(f"Skipped {skipped} records under {MIN_CONTENT_BYTES} bytes in {os.path.basename(filename)}")
+
+def rows_to_batch(rows):
+    """Convert a list of output tuples into a record batch with OUTPUT_SCHEMA."""
+    columns = zip(*rows)
+    return pa.RecordBatch.from_arrays(
+        [pa.array(values, type=field.type) for values, field in zip(columns, OUTPUT_SCHEMA)],
+        schema=OUTPUT_SCHEMA
+    )
+
+def parse_file(filename, exclude_tlds, pool, fast=False):
+    """Parse a single feather file and stream the extracted articles to a processed feather file."""
+    output_file = filename.replace(".feather", "_processed.feather")
+    # Written under a temporary name and renamed once complete, so an interrupted
+    # run never leaves a truncated IPC file (no footer) for step 04 to pick up
+    tmp_file = output_file + ".tmp"
     rows = []
+    seen = set()
+    written = 0
     try:
-        data = pd.read_feather(filename)
-        data["TLD"] = data["URL"].apply(extract_top_level_domain)
-        
-        # Only filter if exclusion list is not empty
-        if len(exclude_tlds) > 0 and "Country Code" in exclude_tlds.columns:
-            data = data[~data["TLD"].isin(exclude_tlds["Country Code"])]
-        else:
+        if not exclude_tlds:
             logging.info(f"No TLD filtering applied (empty exclusion list)")
-        
-        data = data.reset_index(drop=True)
-
-        for _, row in tqdm(data.iterrows(), total=len(data), desc=f"Processing {os.path.basename(filename)}", leave=False):
-            try:
-                extracted = trafilatura.extract(
-                    row["Content"],
-                    include_comments=False,
-                    deduplicate=True,
-                    output_format="json",
-                    with_metadata=True,
-                    # target_language removed - accepting all languages
-                )
-                if extracted:
-                    root = json.loads(extracted)
-                    rows.append({
-                        "id": row["ID"],
-                        "text": root.get("raw_text"),
-                        "url": row["URL"],
-                        "excerpt": root.get("excerpt"),
-                        "date": root.get("date"),
-                        "tags": root.get("tags"),
-                        "categories": root.get("categories"),
-                        "title": root.get("title"),
-                        "date_crawled": root.get("filedate"),
-                        "hostname": root.get("hostname")
-                    })
-            except Exception as e:
-                logging.warning(f"Error processing record {row['URL']}: {e}")
-
-        if rows:
-            output_df = pd.DataFrame(rows).dropna(subset=["text"]).drop_duplicates(subset=["text", "hostname"])
-            output_file = filename.replace(".feather", "_processed.feather")
-            output_df.to_feather(output_file)
-            logging.info(f"Saved processed file: {output_file} ({len(output_df)} articles)")
+
+        records = iter_records(filename, exclude_tlds)
+        results = pool.imap_unordered(partial(extract_record, fast=fast), records, chunksize=64)
+        write_options = pa.ipc.IpcWriteOptions(compression="lz4")
+        with pa.ipc.new_file(tmp_file, OUTPUT_SCHEMA, options=write_options) as writer:
+            for processed, row in enumerate(results, start=1):
+                if processed % LOG_EVERY == 0:
+                    logging.info(f"{os.path.basename(filename)}: {processed} records processed")
+                if row is None:
+                    continue
+
+                # Drop duplicate articles (same text on the same host), keyed by a 64-bit hash
+                text, hostname = row[1], row[9]
+                key = xxhash.xxh3_64_intdigest((text + "\0" + (hostname or "")).encode("utf-8", "surrogatepass"))
+                if key in seen:
+                    continue
+                seen.add(key)
+
+                rows.append(row)
+                if len(rows) >= WRITE_BATCH_SIZE:
+                    writer.write_batch(rows_to_batch(rows))
+                    written += len(rows)
+                    rows = []
+
+            if rows:
+                writer.write_batch(rows_to_batch(rows))
+                written += len(rows)
+
+        if written:
+            os.replace(tmp_file, output_file)
+            logging.info(f"Saved processed file: {output_file} ({written} articles)")
             return True
         else:
+            os.remove(tmp_file)
             logging.warning(f"No valid articles extracted from {filename}")
             return False
 
     except Exception as e:
         logging.error(f"Error processing file {filename}: {e}")
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
         return False
 
-def main(folder, tlds_file):
+def load_tld_exclusions(tlds_file):
+    """Load the excluded TLDs as a frozenset, caching the Excel sheet as a parquet sidecar."""
+    cache_file = tlds_file + ".parquet"
+    if os.path.exists(cache_file) and os.path.getmtime(cache_file) >= os.path.getmtime(tlds_file):
+        tlds_df = pd.read_parquet(cache_file)
+    else:
+        tlds_df = pd.read_excel(tlds_file)
+        try:
+            tlds_df.to_parquet(cache_file, index=False)
+        except Exception as e:
+            logging.warning(f"Could not cache TLD exclusions to {cache_file}: {e}")
+
+    if "Country Code" not in tlds_df.columns:
+        return frozenset()
+    # Normalize to the lowercase, dot-prefixed form produced by extract_top_level_domains
+    return frozenset("." + str(code).strip().lower().lstrip(".") for code in tlds_df["Country Code"].dropna())
+
+def main(folder, tlds_file, fast=False, files_in_flight=2):
     """Main function to process all feather files in the given folder."""
     if not os.path.exists(folder):
         logging.error(f"Folder does not exist: {folder}")
         return
 
-    exclude_tlds = pd.read_excel(tlds_file)
-    files = [os.path.join(folder, f) for f in os.listdir(folder) if f.endswith(".feather") and not f.endswith("_processed.feather")]
+    exclude_tlds = load_tld_exclusions(tlds_file)
+    with os.scandir(folder) as entries:
+        files = [
+            entry.path for entry in entries
+            if entry.is_file() and entry.name.endswith(".feather") and not entry.name.endswith("_processed.feather")
+        ]
 
     if not files:
         logging.warning(f"No feather files found in folder: {folder}")
@@ -105,19 +245,23 @@ def main(folder, tlds_file):
 
     logging.info(f"Processing {len(files)} files from folder: {folder}")
     logging.info(f"TLD exclusions: {len(exclude_tlds)} entries")
+    if fast:
+        logging.info("Fast mode: Trafilatura fallback extractors disabled")
     
-    # Use partial to create a picklable function
-    parse_with_tlds = partial(parse_file, exclude_tlds=exclude_tlds)
-    
-    with multiprocessing.Pool(processes=os.cpu_count()) as pool:
-        with tqdm(total=len(files), desc="Overall Progress") as pbar:
-            for result in pool.imap_unordered(parse_with_tlds, files):
-                pbar.update()
+    # One pool for the whole run; records of each file are spread across all workers.
+    # Several files are fed at once so the pool does not drain while the next file is read.
+    with multiprocessing.Pool(processes=os.cpu_count()) as pool, \
+            ThreadPoolExecutor(max_workers=files_in_flight) as executor:
+        futures = [executor.submit(parse_file, filename, exclude_tlds, pool, fast) for filename in files]
+        for _ in tqdm(as_completed(futures), total=len(futures), desc="Overall Progress"):
+            pass
 
 if __name__ == "__main__":
     parser = ArgumentParser(description="Extract and process text from feather files.")
     parser.add_argument("folder", type=str, help="Folder containing feather files.")
     parser.add_argument("tlds_file", type=str, help="Path to the Excel file containing TLD exclusions.")
+    parser.add_argument("--fast", action="store_true", help="Skip Trafilatura's fallback extractors (faster, slightly lower recall).")
+    parser.add_argument("--files_in_flight", type=int, default=2, help="Number of files fed to the worker pool concurrently.")
     args = parser.parse_args()
 
-    main(args.folder, args.tlds_file)
+    main(args.folder, args.tlds_file, args.fast, args.files_in_flight)
@@ -24,9 +24,11 @@ logging.basicConfig(
 # Pre-compile regular expressions
 sentence_pattern = re.compile(r'\b[^.!?]+[.!?]*')
 
+# Characters that mark a line as a bullet point (built once, not per article)
+bullet_points = frozenset({"\u2022", "\u2023", "\u25B6", "\u25C0", "\u25E6", "\u25A0", "\u25A1", "\u25AA", "\u25AB", "\u2013"})
+
 def compute_metrics(article):
     """Compute quality metrics for a single article."""
-    bullet_points = {"\u2022", "\u2023", "\u25B6", "\u25C0", "\u25E6", "\u25A0", "\u25A1", "\u25AA", "\u25AB", "\u2013"}
     metrics = {
         "fraction_ellipsis": 0,
         "fraction_non_alpha_words": 0,
@@ -38,11 +40,10 @@ def compute_metrics(article):
         "word_count": 0
     }
 
-    total_word_length, non_alpha_word_count, total_words, ellipsis_count = 0, 0, 0, 0
+    total_word_length, non_alpha_word_count, total_words, ellipsis_count, bullet_starts = 0, 0, 0, 0, 0
     lines = article.split('\n')
     for line in lines:
-        line_ended_with_ellipsis = line.endswith("...") or line.endswith("…")
-        ellipsis_count += line_ended_with_ellipsis
+        ellipsis_count += line.endswith(("...", "…"))
 
         words = line.split()
         for word in words:
@@ -50,13 +51,14 @@ def compute_metrics(article):
             total_word_length += len(word)
 
         total_words += len(words)
-        metrics["bullet_point_starts"] += int(line != "" and line[0] in bullet_points)
+        bullet_starts += line[:1] in bullet_points
 
     metrics["fraction_ellipsis"] = ellipsis_count / len(lines) if lines else 0
     metrics["fraction_non_alpha_words"] = non_alpha_word_count / total_words if total_words else 0
     metrics["mean_word_length"] = total_word_length / total_words if total_words else 0
     metrics["words_per_line"] = total_words / len(lines) if lines else 0
     metrics["word_count"] = total_words
+    metrics["bullet_point_starts"] = bullet_starts
 
     return metrics
 
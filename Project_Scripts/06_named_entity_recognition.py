@@ -22,9 +22,25 @@ logging.basicConfig(
     handlers=[logging.StreamHandler()]
 )
 
+# Documents per nlp.pipe batch
+NER_BATCH_SIZE = 64
+
+# Components that do not contribute to entity recognition
+UNUSED_PIPES = ("parser", "tagger", "morphologizer", "lemmatizer", "attribute_ruler", "senter")
+
 # Pre-compiled regex for date extraction
 date_pattern = re.compile(r"\d{8}")
 
+# Pre-compiled regexes for location normalization
+# Keep Unicode word characters (\w), spaces, hyphens, apostrophes; remove everything else
+loc_strip_pattern = re.compile(r"[^\w\s'\-]", flags=re.UNICODE)
+whitespace_pattern = re.compile(r"\s+")
+
+def normalize_location(location):
+    """Normalize a location mention for matching against the geomap."""
+    normalized = loc_strip_pattern.sub("", str(location)).lower().strip()
+    return whitespace_pattern.sub(" ", normalized)  # Collapse multiple spaces
+
 def get_entities(filepath, nlp, out_folder):
     """Extract named entities from a file and save results."""
     try:
@@ -44,21 +60,14 @@ def get_entities(filepath, nlp, out_folder):
         ents_loc = []
         ents_loc_normal = []  # NEW LINE
 
-        # Process each text and extract entities
-        for text in tqdm(data["text"], desc=f"Processing {os.path.basename(filepath)}", leave=False):
-            doc = nlp(text)
+        # Stream texts through spaCy in batches and extract entities
+        docs = nlp.pipe(data["text"], batch_size=NER_BATCH_SIZE)
+        for doc in tqdm(docs, total=len(data), desc=f"Processing {os.path.basename(filepath)}", leave=False):
             locations = [ent.text for ent in doc.ents if ent.label_ == 'city_names']
             ents_loc.append(locations)
             
             # NEW: Create normalized version
-            if locations:
-                first_loc = str(locations[0])
-                # Keep Unicode word characters (\w), spaces, hyphens, apostrophes; remove everything else
-                normalized = re.sub(r"[^\w\s'\-]", "", first_loc, flags=re.UNICODE).lower().strip()
-                normalized = re.sub(r'\s+', ' ', normalized)  # Collapse multiple spaces
-                ents_loc_normal.append(normalized)
-            else:
-                ents_loc_normal.append("")
+            ents_loc_normal.append(normalize_location(locations[0]) if locations else "")
     
 
         # Add extracted entities to the DataFrame
@@ -94,6 +103,9 @@ def main(input_folder, output_folder, model_path):
     
     logging.info(f"Loading spaCy model from: {model_path}")
     nlp = spacy.load(model_path)
+    for name in UNUSED_PIPES:
+        if name in nlp.pipe_names:
+            nlp.disable_pipe(name)
     logging.info(f"Model loaded successfully. Pipeline: {nlp.pipe_names}")
 
     logging.info(f"Starting NER processing on {len(files_to_process)} files.")
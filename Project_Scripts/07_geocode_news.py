@@ -1,25 +1,79 @@
-import re
 import pandas as pd
+import geopandas as gpd
+import pyogrio
 from tqdm import tqdm
-from multiprocessing import Pool
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import xlsxwriter
+import pyarrow.dataset as ds
 from glob import glob
 from geopy.geocoders import Nominatim
-from geopy.extra.rate_limiter import RateLimiter
+from geopy.adapters import AioHTTPAdapter
+from geopy.extra.rate_limiter import AsyncRateLimiter
+import asyncio
+import sqlite3
 import sys
 import os
 
-# Function to read and process feather files
-def read_feather(file_path):
+# Geocoder settings (defaults follow the public Nominatim usage policy)
+NOMINATIM_DOMAIN = os.environ.get("NOMINATIM_DOMAIN", "nominatim.openstreetmap.org")
+NOMINATIM_SCHEME = os.environ.get("NOMINATIM_SCHEME", "https")
+GEOCODER_CONCURRENCY = int(os.environ.get("GEOCODER_CONCURRENCY", "4"))
+GEOCODER_MIN_DELAY = float(os.environ.get("GEOCODER_MIN_DELAY", "1"))
+GEOCODE_CACHE_PATH = os.environ.get("GEOCODE_CACHE_PATH", "/data/CommonCrawl/news/geocode_cache.sqlite")
+CACHE_COMMIT_EVERY = 100
+
+# Columns read from the NER feather files (only the location mentions are used)
+NER_SCHEMA = pa.schema([("loc", pa.list_(pa.string()))])
+
+# Country appended to every geocoding query
+GEOCODE_COUNTRY = "Germany"
+
+# NUTS attributes read from the GISCO file
+NUTS_COLUMNS = ["NUTS_ID", "NUTS_NAME", "LEVL_CODE"]
+
+# Function to read the location mentions from the NER feather files
+def count_location_mentions(files):
+    """
+    Counts identical location mentions across all NER feather files.
+    
+    All files are scanned as one pyarrow dataset (memory-mapped, decoded by
+    Arrow's thread pool); the loc lists are flattened and counted in Arrow,
+    so no per-mention Python objects are created.
+    
+    Returns:
+        Series mapping each distinct raw mention to its number of occurrences
+    """
+    dataset = ds.dataset(files, schema=NER_SCHEMA, format="feather", exclude_invalid_files=True)
+    mentions = pc.drop_null(pc.list_flatten(dataset.to_table().column("loc")))
+    counts = pc.value_counts(mentions)
+    return pd.Series(
+        counts.field("counts").to_numpy(),
+        index=pd.Index(counts.field("values").to_pylist()),
+        name="count"
+    )
+
+def load_nuts_regions(nuts_file):
     """
-    Reads a feather file and returns it as a DataFrame with additional preprocessing.
+    Load the NUTS regions needed for matching, via pyogrio.
+    
+    The first load parses the GeoJSON and writes a FlatGeobuf sidecar next
+    to it; later runs read the much faster binary .fgb file instead. The
+    sidecar is rebuilt when it is older than the GeoJSON or was written
+    with a different NUTS_COLUMNS list.
     """
+    fgb_file = os.path.splitext(nuts_file)[0] + ".fgb"
+    if os.path.exists(fgb_file) and os.path.getmtime(fgb_file) >= os.path.getmtime(nuts_file):
+        if list(pyogrio.read_info(fgb_file)["fields"]) == NUTS_COLUMNS:
+            return gpd.read_file(fgb_file, engine="pyogrio")
+    
+    nuts_gdf = gpd.read_file(nuts_file, engine="pyogrio", columns=NUTS_COLUMNS)
     try:
-        df = pd.read_feather(file_path)
-        df["len"] = df["text"].str.split().str.len()
-        return df
+        nuts_gdf.to_file(fgb_file, driver="FlatGeobuf", engine="pyogrio")
     except Exception as e:
-        print(f"Error reading {file_path}: {e}")
-        return pd.DataFrame()  # Return an empty DataFrame in case of error
+        print(f"   ⚠️  Could not cache NUTS regions to {fgb_file}: {e}")
+    return nuts_gdf
 
 def add_nuts_codes(geomap):
     """
@@ -31,15 +85,6 @@ def add_nuts_codes(geomap):
     Returns:
         DataFrame with added NUTS and GEN columns
     """
-    try:
-        import geopandas as gpd
-        from shapely.geometry import Point
-    except ImportError:
-        print("⚠️  geopandas not installed. Installing...")
-        os.system("pip install -q geopandas")
-        import geopandas as gpd
-        from shapely.geometry import Point
-    
     # Define NUTS file path
     nuts_file = "/home/ubuntu/CommonCrawlNewsDataSet/data/nuts/nuts_2021.geojson"
     
@@ -63,7 +108,7 @@ def add_nuts_codes(geomap):
     # Load NUTS data
     try:
         print(f"🗺️  Loading NUTS regions...")
-        nuts_gdf = gpd.read_file(nuts_file)
+        nuts_gdf = load_nuts_regions(nuts_file)
         print(f"   Loaded {len(nuts_gdf)} NUTS regions")
     except Exception as e:
         print(f"❌ Error loading NUTS data: {e}")
@@ -75,29 +120,133 @@ def add_nuts_codes(geomap):
     geomap['NUTS'] = None
     geomap['GEN'] = None
     
-    # Match coordinates to NUTS regions
+    # Match coordinates to NUTS regions with a single spatial join (uses the spatial index)
     print(f"📍 Matching coordinates to NUTS regions...")
-    matched = 0
-    
-    for idx, row in tqdm(geomap.iterrows(), total=len(geomap), desc="NUTS matching"):
-        if pd.notna(row['latitude']) and pd.notna(row['longitude']):
-            try:
-                point = Point(row['longitude'], row['latitude'])
-                matches = nuts_gdf[nuts_gdf.geometry.contains(point)]
-                
-                if len(matches) > 0:
-                    # Get most detailed region (highest NUTS level)
-                    best_match = matches.sort_values('LEVL_CODE', ascending=False).iloc[0]
-                    geomap.at[idx, 'NUTS'] = best_match['NUTS_ID']
-                    geomap.at[idx, 'GEN'] = best_match['NUTS_NAME']
-                    matched += 1
-            except Exception as e:
-                continue
+    located = geomap[geomap['latitude'].notna() & geomap['longitude'].notna()]
+    points = gpd.GeoDataFrame(
+        index=located.index,
+        geometry=gpd.points_from_xy(located['longitude'].astype(float), located['latitude'].astype(float)),
+        crs="EPSG:4326"
+    )
+    if nuts_gdf.crs is not None:
+        points = points.to_crs(nuts_gdf.crs)
+    joined = gpd.sjoin(points, nuts_gdf[['geometry', 'LEVL_CODE', 'NUTS_ID', 'NUTS_NAME']], predicate='within', how='inner')
+    
+    # Get most detailed region (highest NUTS level) per location
+    best_match = joined.sort_values('LEVL_CODE', ascending=False)
+    best_match = best_match[~best_match.index.duplicated(keep='first')]
+    geomap.loc[best_match.index, 'NUTS'] = best_match['NUTS_ID']
+    geomap.loc[best_match.index, 'GEN'] = best_match['NUTS_NAME']
+    matched = len(best_match)
     
     print(f"   ✅ Matched {matched} / {geomap['latitude'].notna().sum()} locations to NUTS")
     
     return geomap
 
+def load_geocode_cache(path):
+    """
+    Open the persistent geocoding cache and load all known results.
+    
+    Returns:
+        Tuple of (connection, dict mapping loc_normal to (latitude, longitude) or None)
+    """
+    cache = sqlite3.connect(path)
+    cache.execute('''
+        CREATE TABLE IF NOT EXISTS geocode_cache (
+            loc_normal TEXT PRIMARY KEY,
+            latitude REAL,
+            longitude REAL
+        );
+    ''')
+    cache.commit()
+    cached = {
+        name: (lat, lon) if lat is not None else None
+        for name, lat, lon in cache.execute("SELECT loc_normal, latitude, longitude FROM geocode_cache")
+    }
+    return cache, cached
+
+def write_geocode_cache(cache, entries):
+    """Store (loc_normal, latitude, longitude) entries in the geocoding cache in one transaction."""
+    cache.executemany(
+        "INSERT OR REPLACE INTO geocode_cache (loc_normal, latitude, longitude) VALUES (?, ?, ?)",
+        entries
+    )
+    cache.commit()
+
+async def geocode_locations(names, cache=None):
+    """
+    Geocode place names concurrently with Nominatim.
+    
+    Requests overlap on the network while the AsyncRateLimiter keeps the
+    spacing between calls at GEOCODER_MIN_DELAY seconds (1 rps by default,
+    as required by the public Nominatim policy). Point NOMINATIM_DOMAIN (and
+    NOMINATIM_SCHEME=http for a local container) at a self-hosted instance,
+    raise GEOCODER_CONCURRENCY and set GEOCODER_MIN_DELAY=0 to geocode at
+    whatever rate that server sustains.
+    
+    Args:
+        names: List of normalized location names
+        cache: Optional sqlite3 connection from load_geocode_cache; successful
+            lookups (including "not found") are stored there, failures are not
+        
+    Returns:
+        Dict mapping each name to a (latitude, longitude) tuple, or None
+    """
+    results = {}
+    async with Nominatim(
+        user_agent="ADD_USERNAME_HERE",
+        timeout=10,
+        domain=NOMINATIM_DOMAIN,
+        scheme=NOMINATIM_SCHEME,
+        adapter_factory=AioHTTPAdapter
+    ) as geolocator:
+        # Rate limiter with up to 3 retries on failure and exponential back-off
+        geocode = AsyncRateLimiter(
+            geolocator.geocode,
+            min_delay_seconds=GEOCODER_MIN_DELAY,
+            max_retries=3,
+            error_wait_seconds=2.0,
+            swallow_exceptions=False
+        )
+        semaphore = asyncio.Semaphore(GEOCODER_CONCURRENCY)
+
+        async def geocode_one(name):
+            async with semaphore:
+                try:
+                    location = await geocode(f"{name}, {GEOCODE_COUNTRY}")
+                except Exception as e:
+                    print(f"Geocoding failed for {name}: {e}")
+                    return name, None, False
+            return name, (location.latitude, location.longitude) if location else None, True
+
+        pending = []
+        tasks = [geocode_one(name) for name in names]
+        for task in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Geocoding"):
+            name, coords, succeeded = await task
+            results[name] = coords
+            if succeeded and cache is not None:
+                pending.append((name, *(coords or (None, None))))
+                if len(pending) >= CACHE_COMMIT_EVERY:
+                    write_geocode_cache(cache, pending)
+                    pending = []
+        if pending:
+            write_geocode_cache(cache, pending)
+    return results
+
+def write_excel_streaming(df, path):
+    """
+    Write a DataFrame to .xlsx row by row with xlsxwriter's constant_memory mode.
+    
+    pandas' to_excel emits cells column by column, which constant_memory (rows
+    must be written in order) cannot handle, so rows are written directly.
+    """
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+    worksheet = workbook.add_worksheet()
+    worksheet.write_row(0, 0, list(df.columns))
+    for row_idx, row in enumerate(df.itertuples(index=False, name=None), start=1):
+        worksheet.write_row(row_idx, 0, [None if pd.isna(value) else value for value in row])
+    workbook.close()
+
 # Main function for processing feather files and creating geomap
 def main():
     # If no arguments, search for all 06_ner folders automatically
@@ -120,60 +269,28 @@ def main():
         files.extend(found)
         print(f"   Found {len(found)} files in {folder}")
 
-    # Number of processes to use (adjust according to your system's capabilities)
-    num_processes = min(60, len(files))  # Ensure it does not exceed available CPUs
-
-    # Create a pool of workers for parallel processing
-    with Pool(processes=num_processes) as pool:
-        # Use tqdm to display a progress bar
-        dataframes = list(tqdm(pool.imap(read_feather, files), total=len(files)))
-
-    # Concatenate all DataFrames into one large DataFrame
-    combined_df = pd.concat(dataframes, ignore_index=True)
-
-    # Process and clean location data
-    combined_df = combined_df.explode("loc").dropna(subset=["loc"])
-    combined_df["loc_normal"] = combined_df["loc"].apply(
-        lambda x: re.sub(r"[^a-zA-Zäöüß'\- ]", "", str(x).lower()).strip()
+    # Count identical location mentions first, so cleaning runs once per distinct string
+    mention_counts = count_location_mentions(files)
+    loc_normal = (
+        mention_counts.index.str.lower()
+        .str.replace(r"[^a-zäöüß'\- ]", "", regex=True)
+        .str.strip()
     )
-    combined_df = combined_df[combined_df["loc_normal"] != ""]
 
     # Group by normalized location and filter by occurrence count
-    geomap = combined_df.groupby("loc_normal").size().reset_index(name="count")
-    geomap = geomap[geomap["count"] > 100]
-
-    #Initialize Geolocator
-    geolocator = Nominatim(user_agent="ADD_USERNAME_HERE", timeout=10)
-
-    # RateLimiter: 1 call/sec, with up to 3 retries on failure and exponential back-off
-    geocode = RateLimiter(
-    geolocator.geocode,
-    min_delay_seconds=1,
-    max_retries=3,
-    error_wait_seconds=2.0,
-    swallow_exceptions=False
-    )
-
-    # Prepare result columns
-    geomap["latitude"] = None
-    geomap["longitude"] = None
+    geomap = mention_counts.groupby(loc_normal).sum().rename_axis("loc_normal").reset_index(name="count")
+    geomap = geomap[(geomap["loc_normal"] != "") & (geomap["count"] > 100)]
 
-    # Iterate over each place name and geocode
-    print(f"🔍 Geocoding {len(geomap)} locations...")
-    for idx, row in tqdm(geomap.iterrows(), total=len(geomap), desc="Geocoding"):
-        try:
-            location = geocode(row["loc_normal"] + ", Germany")
-
-            if location:
-                geomap.at[idx, "latitude"] = location.latitude
-                geomap.at[idx, "longitude"] = location.longitude
-            else:
-                geomap.at[idx, "latitude"] = None
-                geomap.at[idx, "longitude"] = None
-        except Exception as e:
-            print(f"Geocoding failed for {row['loc_normal']}: {e}")
-            geomap.at[idx, "latitude"] = None
-            geomap.at[idx, "longitude"] = None
+    # Geocode place names not yet in the cache concurrently and assign coordinates in bulk
+    cache, coordinates = load_geocode_cache(GEOCODE_CACHE_PATH)
+    to_geocode = [name for name in geomap["loc_normal"] if name not in coordinates]
+    print(f"🔍 Geocoding {len(to_geocode)} locations ({len(geomap) - len(to_geocode)} cached)...")
+    try:
+        coordinates.update(asyncio.run(geocode_locations(to_geocode, cache)))
+    finally:
+        cache.close()
+    geomap["latitude"] = geomap["loc_normal"].map({name: c[0] for name, c in coordinates.items() if c})
+    geomap["longitude"] = geomap["loc_normal"].map({name: c[1] for name, c in coordinates.items() if c})
 
     # Add NUTS codes (NEW - single function call)
     print()
@@ -181,8 +298,8 @@ def main():
 
     # Now you can save or continue with your spatial join…
     print()
-    geomap.to_excel('/data/CommonCrawl/news/geomap.xlsx', index=False)
-    geomap.to_csv('/data/CommonCrawl/news/geomap.csv', index=False)
+    write_excel_streaming(geomap, '/data/CommonCrawl/news/geomap.xlsx')
+    pa_csv.write_csv(pa.Table.from_pandas(geomap, preserve_index=False), '/data/CommonCrawl/news/geomap.csv')
     print("✅ Saved geomap to:")
     print("   Excel: /data/CommonCrawl/news/geomap.xlsx")
     print("   CSV: /data/CommonCrawl/news/geomap.csv")
@@ -6,29 +6,27 @@ from tqdm import tqdm
 import hashlib
 import logging
 from argparse import ArgumentParser
-import re
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # Functions
-def strip_uuid(uuid_str: str) -> str:
-    """Convert UUID to a stripped format."""
-    if uuid_str.startswith("<urn:uuid:") and uuid_str.endswith(">"):
-        return uuid_str[10:-1]
-    return uuid_str
-
-def extract_tld(hostname: str) -> str:
-    """Extract the top-level domain (TLD) from a hostname."""
-    try:
-        return hostname.split('.')[-1]
-    except Exception:
-        return ""
+def strip_uuids(uuids: pd.Series) -> pd.Series:
+    """Convert WARC record UUIDs to a stripped format."""
+    return uuids.str.replace(r"^<urn:uuid:(.*)>$", r"\1", regex=True)
 
 def hash_uuid(uuid_str: str) -> int:
     """Generate a hashed integer (63-bit) from UUID using SHA-256."""
     return int(hashlib.sha256(uuid_str.encode()).hexdigest(), 16) % (2**63 - 1)
 
+# Column layout of the Loaded_Files table
+LOADED_FILES_COLUMNS = ["filename", "size", "mtime_ns", "geomap_sha1"]
+
+def file_sha1(path: str) -> str:
+    """Fingerprint a file by the SHA-1 of its contents."""
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
 def create_tables(cursor):
     """Create database tables if they don't exist."""
     logging.info("Creating database tables...")
@@ -64,12 +62,40 @@ def create_tables(cursor):
             FOREIGN KEY (location_id) REFERENCES Locations(location_id)
         );
     ''')
+    # Reloaded files must not append duplicate links. Databases from before the unique
+    # index may already hold duplicates, which are dropped once before it is created
+    has_index = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_article_locations'"
+    ).fetchone()
+    if not has_index:
+        cursor.execute('''
+            DELETE FROM Article_Locations WHERE rowid NOT IN (
+                SELECT MIN(rowid) FROM Article_Locations GROUP BY article_id, location_id
+            );
+        ''')
+        cursor.execute('''
+            CREATE UNIQUE INDEX idx_article_locations
+            ON Article_Locations (article_id, location_id);
+        ''')
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS Article_Vectors (
             id TEXT PRIMARY KEY,
             hashed_id INTEGER UNIQUE
         );
     ''')
+    # Loaded_Files only records what can be skipped on a rerun, so an older layout
+    # is simply dropped (its files are reloaded once)
+    loaded_files_columns = [row[1] for row in cursor.execute("PRAGMA table_info(Loaded_Files)")]
+    if loaded_files_columns and loaded_files_columns != LOADED_FILES_COLUMNS:
+        cursor.execute("DROP TABLE Loaded_Files")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS Loaded_Files (
+            filename TEXT PRIMARY KEY,
+            size INTEGER,
+            mtime_ns INTEGER,
+            geomap_sha1 TEXT
+        );
+    ''')
     cursor.connection.commit()
 
 def load_location_mapping(geomap_path: str) -> Tuple[Dict[str, int], pd.DataFrame]:
@@ -93,13 +119,26 @@ def insert_locations(df: pd.DataFrame, cursor):
     ''', locations)
     cursor.connection.commit()
 
-def load_and_insert_metadata(directory: str, location_map: Dict[str, int], cursor):
+def load_and_insert_metadata(directory: str, location_map: Dict[str, int], geomap_sha1: str, cursor,
+                             reprocess: bool = False):
     """Load metadata from files and insert it into the database."""
     logging.info(f"Processing metadata files in {directory}...")
+    # Files committed by a previous run are skipped if neither the file (size, mtime)
+    # nor the geomap changed since; a regenerated geomap reloads everything to relink
+    # locations, and reprocess=True ignores the record entirely
+    loaded_files = {} if reprocess else {
+        filename: (size, mtime_ns) for filename, size, mtime_ns in cursor.execute(
+            "SELECT filename, size, mtime_ns FROM Loaded_Files WHERE geomap_sha1 = ?", (geomap_sha1,)
+        )
+    }
+    logging.info(f"{len(loaded_files)} files already loaded.")
     for filename in tqdm(os.listdir(directory)):
         if filename.endswith('.feather'):
+            file_path = os.path.join(directory, filename)
+            stat = os.stat(file_path)
+            if loaded_files.get(filename) == (stat.st_size, stat.st_mtime_ns):
+                continue
             try:
-                file_path = os.path.join(directory, filename)
                 data = pd.read_feather(file_path)
 
                 # Ensure required columns exist
@@ -110,31 +149,30 @@ def load_and_insert_metadata(directory: str, location_map: Dict[str, int], curso
                     logging.error(f"Skipping {filename}: Missing columns {missing_columns}")
                     continue
 
-                data["id"] = data["id"].apply(strip_uuid)
-                data["tld"] = data["hostname"].apply(extract_tld)
+                data["id"] = strip_uuids(data["id"])
 
                 # Ensure 'loc_normal' exists and is cleaned properly
-                data["loc_normal"] = data["loc_normal"].fillna("").astype(str).str.lower()
-                data["loc_normal"] = data["loc_normal"].apply(lambda x: re.sub(r"[^a-zäöüß ']", "", x).strip())
-
-                articles = []
+                data["loc_normal"] = (
+                    data["loc_normal"].fillna("").astype(str).str.lower()
+                    .str.replace(r"[^a-zäöüß ']", "", regex=True)
+                    .str.strip()
+                )
+
+                # Plain tuples straight from the columns; no per-row Series
+                articles = list(data[[
+                    'id', 'url', 'excerpt', 'title', 'text', 'tags',
+                    'categories', 'hostname', 'date', 'date_crawled'
+                ]].itertuples(index=False, name=None))
+
+                article_ids = data['id'].tolist()
                 article_locations = []
-                article_vectors = []
-                
-                for _, row in data.iterrows():
-                    articles.append((
-                        row['id'], row['url'], row['excerpt'], row['title'], 
-                        row['text'], row['tags'], row['categories'], row['hostname'], 
-                        row.get('date', None), row.get('date_crawled', None)
-                    ))
-                    
-                    location_id = location_map.get(row['loc_normal'])
+                for article_id, loc_normal in zip(article_ids, data['loc_normal'].tolist()):
+                    location_id = location_map.get(loc_normal)
                     if location_id:
-                        article_locations.append((row['id'], location_id))
+                        article_locations.append((article_id, location_id))
 
-                    # Generate hashed ID for each article
-                    hashed_id = hash_uuid(row['id'])
-                    article_vectors.append((row['id'], hashed_id))
+                # Generate hashed ID for each article
+                article_vectors = [(article_id, hash_uuid(article_id)) for article_id in article_ids]
 
                 # Perform batch inserts
                 cursor.executemany('''
@@ -142,6 +180,11 @@ def load_and_insert_metadata(directory: str, location_map: Dict[str, int], curso
                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 ''', articles)
 
+                # Relink from scratch so links to locations dropped from the geomap go away
+                cursor.executemany(
+                    "DELETE FROM Article_Locations WHERE article_id = ?",
+                    [(article_id,) for article_id in article_ids]
+                )
                 cursor.executemany('''
                     INSERT OR IGNORE INTO Article_Locations (article_id, location_id)
                     VALUES (?, ?)
@@ -151,6 +194,11 @@ def load_and_insert_metadata(directory: str, location_map: Dict[str, int], curso
                     INSERT OR IGNORE INTO Article_Vectors (id, hashed_id)
                     VALUES (?, ?)
                 ''', article_vectors)
+
+                cursor.execute(
+                    "INSERT OR REPLACE INTO Loaded_Files (filename, size, mtime_ns, geomap_sha1) VALUES (?, ?, ?, ?)",
+                    (filename, stat.st_size, stat.st_mtime_ns, geomap_sha1)
+                )
                 
                 cursor.connection.commit()  # Commit once per file for better performance
 
@@ -158,16 +206,21 @@ def load_and_insert_metadata(directory: str, location_map: Dict[str, int], curso
                 logging.error(f"Error processing file {filename}: {e}", exc_info=True)
 
 # Main function
-def main(text_metadata_dir, geomap_path, db_path):
+def main(text_metadata_dir, geomap_path, db_path, reprocess=False):
     logging.info("Starting the database pipeline...")
     connection = sqlite3.connect(db_path, timeout=30)
     cursor = connection.cursor()
     try:
         cursor.execute("PRAGMA journal_mode=WAL;")
+        # WAL only needs an fsync at checkpoints; keep sort/index temp data in RAM
+        cursor.execute("PRAGMA synchronous=NORMAL;")
+        cursor.execute("PRAGMA temp_store=MEMORY;")
+        cursor.execute("PRAGMA mmap_size=268435456;")  # 256 MiB
+        cursor.execute("PRAGMA cache_size=-262144;")  # 256 MiB, negative = KiB
         create_tables(cursor)
         location_map, locations_df = load_location_mapping(geomap_path)
         insert_locations(locations_df, cursor)
-        load_and_insert_metadata(text_metadata_dir, location_map, cursor)
+        load_and_insert_metadata(text_metadata_dir, location_map, file_sha1(geomap_path), cursor, reprocess)
     except Exception as e:
         logging.error(f"An error occurred: {e}", exc_info=True)
     finally:
@@ -179,6 +232,7 @@ if __name__ == "__main__":
     parser.add_argument("text_metadata_dir", type=str, help="Directory containing text metadata files.")
     parser.add_argument("geomap_path", type=str, help="Path to the geomap file.")
     parser.add_argument("db_path", type=str, help="Path to the SQLite database.")
+    parser.add_argument("--reprocess", action="store_true", help="Reload every file, even ones already recorded as loaded.")
     args = parser.parse_args()
 
-    main(args.text_metadata_dir, args.geomap_path, args.db_path)
+    main(args.text_metadata_dir, args.geomap_path, args.db_path, args.reprocess)
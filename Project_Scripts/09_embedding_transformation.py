@@ -5,12 +5,22 @@ import torch
 from sentence_transformers import quantize_embeddings
 import numpy as np
 
-conn=sqlite3.connect(DB_PATH)
-data=pd.read_sql("SELECT id, text FROM articles",conn)
+# Rows pulled from SQLite per encode() call
+READ_CHUNK_SIZE=10_000
 
 embedding_model=SentenceTransformer("mixedbread-ai/deepset-mxbai-embed-de-large-v1",device="cuda",model_kwargs={"torch_dtype": "float16"})
 
-embeddings=embedding_model.encode(list(data["text"]),normalize_embeddings=True,prompt="passage: ")
+# Stream articles out of SQLite so encoding starts with the first chunk
+conn=sqlite3.connect(DB_PATH)
+chunks=[]
+embedding_chunks=[]
+for chunk in pd.read_sql("SELECT id, text FROM articles",conn,chunksize=READ_CHUNK_SIZE):
+    embedding_chunks.append(embedding_model.encode(list(chunk["text"]),normalize_embeddings=True,prompt="passage: "))
+    chunks.append(chunk)
+conn.close()
+
+data=pd.concat(chunks,ignore_index=True)
+embeddings=np.vstack(embedding_chunks)
 
 embedding_min = embeddings.min(axis=0)
 embedding_max = embeddings.max(axis=0)
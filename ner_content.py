@@ -1,7 +1,5 @@
 import pandas as pd
 from glob import glob
-from collections import Counter, defaultdict
-import re
 
 print("🔍 Analyzing Hostname-Location Patterns...\n")
 
@@ -31,50 +29,42 @@ tld_counts = combined['tld'].value_counts().head(15)
 for tld, count in tld_counts.items():
     print(f"   .{tld}: {count:,}")
 
-print("\n🌍 Sample Hostname → Location mappings:")
-location_by_hostname = defaultdict(Counter)
+# Expand location mentions once (one row per hostname/location) and clean them vectorized
+mentions = combined.loc[combined['hostname'].notna(), ['hostname', 'tld', 'loc']].explode('loc').dropna(subset=['loc'])
+mentions['loc_clean'] = (
+    mentions['loc'].astype(str).str.lower()
+    .str.replace(r"[^a-zäöüß'\- ]", "", regex=True)
+    .str.strip()
+)
+mentions = mentions[mentions['loc_clean'] != ""]
 
-for _, row in combined.iterrows():
-    if pd.notna(row['hostname']) and isinstance(row['loc'], list) and len(row['loc']) > 0:
-        hostname = row['hostname']
-        tld = row['tld']
-        for loc in row['loc']:
-            loc_clean = re.sub(r"[^a-zA-Zäöüß'\- ]", "", str(loc).lower()).strip()
-            if loc_clean:
-                location_by_hostname[hostname][loc_clean] += 1
+print("\n🌍 Sample Hostname → Location mappings:")
+location_by_hostname = mentions.groupby(['hostname', 'loc_clean'], sort=False).size()
 
 # Show examples
 print("\nTop 10 hostnames with their locations:")
-for hostname, loc_counter in list(location_by_hostname.items())[:10]:
+for hostname in mentions['hostname'].unique()[:10]:
     tld = extract_tld(hostname)
-    top_locs = loc_counter.most_common(3)
-    locs_str = ", ".join([f"{loc} ({cnt})" for loc, cnt in top_locs])
+    top_locs = location_by_hostname.loc[hostname].nlargest(3)
+    locs_str = ", ".join([f"{loc} ({cnt})" for loc, cnt in top_locs.items()])
     print(f"   {hostname} (.{tld})")
     print(f"      → {locs_str}")
 
 print("\n🔍 Location-TLD associations:")
-location_tld_map = defaultdict(Counter)
-
-for _, row in combined.iterrows():
-    if pd.notna(row['hostname']) and isinstance(row['loc'], list):
-        tld = row['tld']
-        for loc in row['loc']:
-            loc_clean = re.sub(r"[^a-zA-Zäöüß'\- ]", "", str(loc).lower()).strip()
-            if loc_clean:
-                location_tld_map[loc_clean][tld] += 1
+location_tld_map = mentions.groupby(['loc_clean', 'tld'], sort=False).size()
+tlds_per_location = location_tld_map.groupby(level=0, sort=False).size()
+mentions_per_location = location_tld_map.groupby(level=0, sort=False).sum()
 
 # Show locations that appear on multiple TLDs (ambiguous cases)
 print("\nLocations appearing on multiple TLDs (need smart geocoding):")
-ambiguous = {loc: tlds for loc, tlds in location_tld_map.items() if len(tlds) > 2}
-for loc, tld_counter in sorted(ambiguous.items(), key=lambda x: sum(x[1].values()), reverse=True)[:15]:
-    total = sum(tld_counter.values())
-    top_tlds = tld_counter.most_common(3)
-    tlds_str = ", ".join([f".{tld} ({cnt})" for tld, cnt in top_tlds])
+ambiguous = mentions_per_location[tlds_per_location > 2].sort_values(ascending=False, kind="stable")
+for loc, total in ambiguous.head(15).items():
+    top_tlds = location_tld_map.loc[loc].nlargest(3)
+    tlds_str = ", ".join([f".{tld} ({cnt})" for tld, cnt in top_tlds.items()])
     print(f"   {loc} ({total} mentions): {tlds_str}")
 
 print("\n✅ Locations strongly associated with one TLD:")
-single_tld = {loc: tlds for loc, tlds in location_tld_map.items() if len(tlds) == 1}
-for loc, tld_counter in list(single_tld.items())[:10]:
-    tld, count = list(tld_counter.items())[0]
+single_tld = tlds_per_location[tlds_per_location == 1].index[:10]
+for loc in single_tld:
+    tld, count = next(iter(location_tld_map.loc[loc].items()))
     print(f"   {loc} → .{tld} ({count} times)")
-    
\ No newline at end of file
@@ -1,7 +1,5 @@
 import pandas as pd
 import geopandas as gpd
-from shapely.geometry import Point
-from tqdm import tqdm
 
 print("📂 Loading geomap...")
 df = pd.read_excel("/data/CommonCrawl/news/geomap.xlsx")
@@ -30,55 +28,35 @@ for col in ['NUTS0', 'NUTS1', 'NUTS2', 'NUTS3', 'NUTS_NAME']:
     if col not in df.columns:
         df[col] = None
 
-# Function to get NUTS codes for a coordinate
-def get_nuts_info(lat, lon):
-    """Get NUTS codes for given coordinates."""
-    if pd.isna(lat) or pd.isna(lon):
-        return {'NUTS0': None, 'NUTS1': None, 'NUTS2': None, 'NUTS3': None, 'NUTS_NAME': None}
-    
-    try:
-        point = Point(lon, lat)
-        
-        # Find all NUTS regions containing this point
-        matches = nuts_gdf[nuts_gdf.geometry.contains(point)]
-        
-        if len(matches) == 0:
-            return {'NUTS0': None, 'NUTS1': None, 'NUTS2': None, 'NUTS3': None, 'NUTS_NAME': None}
-        
-        # Get the most detailed region (highest NUTS level)
-        # Level 3 is most detailed, Level 0 is country
-        best_match = matches.sort_values('LEVL_CODE', ascending=False).iloc[0]
-        
-        nuts_id = best_match['NUTS_ID']
-        nuts_name = best_match['NUTS_NAME']
-        
-        # Extract different NUTS levels from the ID
-        # Example: DE212 -> DE (country), DE2 (region), DE21 (district), DE212 (subdistrict)
-        return {
-            'NUTS0': nuts_id[:2] if len(nuts_id) >= 2 else None,
-            'NUTS1': nuts_id[:3] if len(nuts_id) >= 3 else None,
-            'NUTS2': nuts_id[:4] if len(nuts_id) >= 4 else None,
-            'NUTS3': nuts_id[:5] if len(nuts_id) >= 5 else nuts_id,
-            'NUTS_NAME': nuts_name
-        }
-    
-    except Exception as e:
-        print(f"⚠️  Error processing ({lat}, {lon}): {e}")
-        return {'NUTS0': None, 'NUTS1': None, 'NUTS2': None, 'NUTS3': None, 'NUTS_NAME': None}
-
-# Process each location
+# Match coordinates to NUTS regions with a single spatial join (uses the spatial index)
 print(f"\n🔍 Matching coordinates to NUTS regions...")
-successful = 0
-
-for idx, row in tqdm(df.iterrows(), total=len(df), desc="Processing"):
-    if pd.notna(row['latitude']) and pd.notna(row['longitude']):
-        nuts_info = get_nuts_info(row['latitude'], row['longitude'])
-        
-        for key, value in nuts_info.items():
-            df.at[idx, key] = value
-        
-        if nuts_info['NUTS3'] is not None:
-            successful += 1
+nuts_cols = ['NUTS0', 'NUTS1', 'NUTS2', 'NUTS3', 'NUTS_NAME']
+located = df[df['latitude'].notna() & df['longitude'].notna()]
+df.loc[located.index, nuts_cols] = None
+
+points = gpd.GeoDataFrame(
+    index=located.index,
+    geometry=gpd.points_from_xy(located['longitude'].astype(float), located['latitude'].astype(float)),
+    crs="EPSG:4326"
+)
+if nuts_gdf.crs is not None:
+    points = points.to_crs(nuts_gdf.crs)
+joined = gpd.sjoin(points, nuts_gdf[['geometry', 'LEVL_CODE', 'NUTS_ID', 'NUTS_NAME']], predicate='within', how='inner')
+
+# Get the most detailed region (highest NUTS level)
+# Level 3 is most detailed, Level 0 is country
+best_match = joined.sort_values('LEVL_CODE', ascending=False)
+best_match = best_match[~best_match.index.duplicated(keep='first')]
+
+# Extract different NUTS levels from the ID
+# Example: DE212 -> DE (country), DE2 (region), DE21 (district), DE212 (subdistrict)
+nuts_id = best_match['NUTS_ID']
+df.loc[best_match.index, 'NUTS0'] = nuts_id.str[:2].where(nuts_id.str.len() >= 2)
+df.loc[best_match.index, 'NUTS1'] = nuts_id.str[:3].where(nuts_id.str.len() >= 3)
+df.loc[best_match.index, 'NUTS2'] = nuts_id.str[:4].where(nuts_id.str.len() >= 4)
+df.loc[best_match.index, 'NUTS3'] = nuts_id.str[:5]
+df.loc[best_match.index, 'NUTS_NAME'] = best_match['NUTS_NAME']
+successful = len(best_match)
 
 # Also add legacy 'NUTS' column for backward compatibility (use NUTS3 or NUTS2)
 df['NUTS'] = df['NUTS3'].fillna(df['NUTS2'])